@@ -1,24 +1,34 @@
 #!/usr/bin/env python3
+import functools
 import hashlib
+import multiprocessing
 import os
 import pathlib
+import re
 import shutil
+import string
+import sqlite3
 import sys
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from sys import platform
 
+# Persistent cache of `hb-shape` results, keyed by font contents, options and
+# unicodes. Shaping is deterministic, so most cases don't have to be re-run.
+HB_SHAPE_CACHE_PATH = Path(__file__).parent / ".hb_shape_cache.sqlite"
+
 # harfbuzz test files that will be ignored.
-IGNORE_TESTS = [
+IGNORE_TESTS = frozenset({
     "macos.tests", # We disable these here because we handle MacOS tests separately.
     "coretext.tests",
     "directwrite.tests",
     "uniscribe.tests",
     "arabic-fallback-shaping.tests",
-]
+})
 
 # harfbuzz test cases that will be ignored.
-IGNORE_TEST_CASES = [
+IGNORE_TEST_CASES = frozenset({
     # aots tests
     # in-house tests
     # --shaper=fallback is not supported.
@@ -59,7 +69,7 @@ IGNORE_TEST_CASES = [
 
     # https://github.com/harfbuzz/harfrust/pull/52
     "vertical_016",
-]
+})
 
 
 def check_hb_build(hb_shape_exe):
@@ -79,38 +89,288 @@ def update_font_path(tests_name, fontfile):
         return fontfile
 
 
+# The same few fonts are used by many test cases, so only resolve their
+# paths once.
+#
+# Returns the font path used in the Rust tests and the name of the font that
+# has to be copied into `tests/fonts` or `None`.
+@functools.lru_cache(maxsize=None)
+def resolve_font_path_rs(tests_name, fontfile, custom):
+    fontfile_rs = fontfile if custom else update_font_path(tests_name, fontfile)
+    font = None if fontfile.startswith("/") else os.path.basename(fontfile_rs)
+    return fontfile_rs, font
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_abs_font_path(root_dir, tests_name, fontfile, custom):
+    if custom:
+        return str(root_dir / fontfile)
+
+    return str(root_dir / "test/shape/data" / tests_name / "tests" / fontfile)
+
+
+UNICODE_PREFIX_RE = re.compile(r"U\+")
+
+# Options that we drop from harfbuzz tests. We always use our own OpenType
+# implementation and don't support font scaling.
+PRUNED_OPTIONS_RE = re.compile(
+    r"--shaper=ot| ?--font-funcs=(?:ft|ot)|--font-size=1000"
+)
+
+# Options that make the results stored in harfbuzz tests unusable for us.
+STORED_RESULT_OPTIONS_RE = re.compile(
+    r"--font-funcs=ft|--font-size=|--not-found-variation-selector-glyph="
+)
+
+
+# `some-test.tests` -> `some_test`
+@functools.lru_cache(maxsize=None)
+def test_name_prefix(file_name):
+    return file_name.replace(".tests", "").replace("-", "_").lower()
+
+
 # Converts `U+0041,U+0078` or `0041,0078` into `\u{0041}\u{0078}`
 def convert_unicodes(unicodes):
-    text = ""
-    for i, u in enumerate(unicodes.split(",")):
-        if i > 0 and i % 10 == 0:
-            text += "\\\n             "
+    items = UNICODE_PREFIX_RE.sub("", unicodes).split(",")
+    if len(items) <= 10:
+        # Fits on a single line.
+        return "".join([f"\\u{{{u}}}" for u in items])
 
-        if u.startswith("U+"):
-            u = u[2:]
+    parts = []
+    for i, u in enumerate(items):
+        if i > 0 and i % 10 == 0:
+            parts.append("\\\n             ")
 
-        text += f"\\u{{{u}}}"
+        parts.append(f"\\u{{{u}}}")
 
-    return text
+    return "".join(parts)
 
 
+@functools.lru_cache(maxsize=None)
 def prune_test_options(options):
-    options = options.replace("--shaper=ot", "")
-    options = options.replace(" --font-funcs=ft", "").replace("--font-funcs=ft", "")
-    options = options.replace(" --font-funcs=ot", "").replace("--font-funcs=ot", "")
-    # we don't support font scaling
-    options = options.replace("--font-size=1000", "")
+    options = PRUNED_OPTIONS_RE.sub("", options)
     # We don't support glyphs > u16
     options = options.replace("--not-found-variation-selector-glyph=1000000", "--not-found-variation-selector-glyph=64000")
     options = options.strip()
     return options
 
 
-def convert_test_file(
-    root_dir, hb_shape_exe, tests_name, file_name, idx, data, fonts, custom
-):
+# Rust tests for cases without and with an expected output.
+SHAPE_TEST_TEMPLATE = string.Template(
+    "#[test]\n"
+    "fn $name() {\n"
+    "    shape(\n"
+    '        "$font",\n'
+    '        "$unicodes",\n'
+    '        "$options",\n'
+    "    );\n"
+    "}\n"
+    "\n"
+)
+ASSERT_SHAPE_TEST_TEMPLATE = string.Template(
+    "#[test]\n"
+    "fn $name() {\n"
+    "    assert_eq!(\n"
+    "        shape(\n"
+    '            "$font",\n'
+    '            "$unicodes",\n'
+    '            "$options",\n'
+    "        ),\n"
+    '        "$glyphs"\n'
+    "    );\n"
+    "}\n"
+    "\n"
+)
+
+# `hb-shape --batch` reads each line into a fixed-size buffer and splits it
+# into at most 64 arguments on `;`.
+HB_SHAPE_BATCH_MAX_LINE = 4000
+HB_SHAPE_BATCH_MAX_ARGS = 62
+
+# A long-lived `hb-shape --batch` process, started lazily once per worker.
+_hb_shape_batch = None
+
+
+# Runs a one-off `hb-shape` and returns its output.
+#
+# Uses `posix_spawn` where available, so the worker's address space doesn't
+# have to be duplicated by `fork` only to be replaced by `exec` right away.
+def spawn_hb_shape(argv):
+    if not hasattr(os, "posix_spawn"):
+        return subprocess.run(
+            argv,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout.decode()
+
+    # Both ends are non-inheritable, only the `dup2`-ed stdout is passed on.
+    read_fd, write_fd = os.pipe()
+    try:
+        try:
+            pid = os.posix_spawn(
+                argv[0],
+                argv,
+                os.environ,
+                file_actions=[
+                    (os.POSIX_SPAWN_DUP2, write_fd, 1),
+                    (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0),
+                ],
+            )
+        finally:
+            os.close(write_fd)
+
+        chunks = []
+        while chunk := os.read(read_fd, 1 << 16):
+            chunks.append(chunk)
+    finally:
+        os.close(read_fd)
+
+    returncode = os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, argv)
+
+    return b"".join(chunks).decode()
+
+
+# Runs `hb-shape` with the given arguments and returns its output.
+#
+# Goes through the worker's batch process, so we don't pay for a process
+# spawn per test case. Falls back to a one-off `hb-shape` invocation for
+# arguments that can't be expressed as a batch line.
+def run_hb_shape(hb_shape_exe, args):
+    global _hb_shape_batch
+
+    line = ";".join(args)
+    if (
+        any(";" in arg or "\n" in arg for arg in args)
+        or len(line) > HB_SHAPE_BATCH_MAX_LINE
+        or len(args) > HB_SHAPE_BATCH_MAX_ARGS
+    ):
+        return spawn_hb_shape([hb_shape_exe] + args)
+
+    if _hb_shape_batch is None:
+        # The process exits on its own once the worker goes away and its
+        # stdin is closed.
+        _hb_shape_batch = subprocess.Popen(
+            [hb_shape_exe, "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=1 << 20,
+            text=True,
+        )
+
+    _hb_shape_batch.stdin.write(line + "\n")
+    _hb_shape_batch.stdin.flush()
+    output = _hb_shape_batch.stdout.readline()
+    if not output:
+        # hb-shape exits on fatal errors, e.g. when the font doesn't exist.
+        returncode = _hb_shape_batch.wait()
+        _hb_shape_batch = None
+        raise subprocess.CalledProcessError(returncode, [hb_shape_exe] + args)
+
+    if not output.startswith("["):
+        # `--batch` doesn't report the exit status of each line. hb-shape just
+        # prints an error instead of the glyphs and carries on, so re-run the
+        # case on its own to fail the same way a one-off invocation does.
+        return spawn_hb_shape([hb_shape_exe] + args)
+
+    return output
+
+
+# Opens the `hb-shape` result cache, creating it if missing.
+#
+# All entries are dropped when the harfbuzz build changed since they were
+# recorded, since a different harfbuzz can produce different results.
+def open_shape_cache(hb_dir, hb_shape_exe):
+    # Meson also creates `libharfbuzz.*.p` directories for the object files,
+    # and the versioned library is reachable through several symlinks.
+    libs = {
+        path.resolve()
+        for path in hb_dir.glob("builddir/src/libharfbuzz.*")
+        if path.is_file()
+    }
+
+    build = hashlib.sha256()
+    for path in [hb_shape_exe] + sorted(libs):
+        build.update(path.read_bytes())
+    build = build.hexdigest()
+
+    cache = sqlite3.connect(HB_SHAPE_CACHE_PATH)
+    # Lets the workers read the cache while we are adding new results.
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute("CREATE TABLE IF NOT EXISTS c (key BLOB PRIMARY KEY, glyphs TEXT)")
+    cache.execute("CREATE TABLE IF NOT EXISTS build (hash TEXT)")
+
+    if cache.execute("SELECT hash FROM build").fetchone() != (build,):
+        cache.execute("DELETE FROM c")
+        cache.execute("DELETE FROM build")
+        cache.execute("INSERT INTO build VALUES (?)", (build,))
+        cache.commit()
+
+    return cache
+
+
+# Per-worker state for `lookup_shape_cache`.
+_shape_cache_reader = None
+
+# Per-worker `hb-shape` results, keyed by `(font_path, options, unicodes)`.
+# Test cases are often duplicated across test files, and identical ones are
+# handed to the same worker next to each other.
+_shape_memo = {}
+
+
+# Fonts are hashed only once per process, without reading them into memory
+# as a whole.
+@functools.lru_cache(maxsize=None)
+def font_hash(path):
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+        digest = hashlib.sha256()
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        while size := f.readinto(buf):
+            digest.update(view[:size])
+
+        return digest.hexdigest()
+
+
+def shape_cache_key(font_path, options, unicodes):
+    # `;` can't appear in any of the fields of a test case.
+    return f"{font_hash(font_path)};{options};{unicodes}".encode()
+
+
+# Returns the cached `hb-shape` result for `key` or `None`.
+#
+# Workers only ever read from the cache. New results are handed back to the
+# main process, which is the only writer.
+def lookup_shape_cache(key):
+    global _shape_cache_reader
+
+    if _shape_cache_reader is None:
+        _shape_cache_reader = sqlite3.connect(HB_SHAPE_CACHE_PATH)
+
+    row = _shape_cache_reader.execute(
+        "SELECT glyphs FROM c WHERE key=?", (key,)
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+# Converts a single `(file_name, idx, data, after_directive)` test case into a
+# Rust test.
+#
+# Runs in a worker process, so it must not touch any shared state. Returns
+# `(rust_snippet, font, cache_entry)`, where `font` is the basename of the font
+# that has to be copied into `tests/fonts` or `None`, and `cache_entry` is a
+# new `(key, glyphs)` pair for the shape cache or `None`.
+def convert_test_file(root_dir, hb_shape_exe, tests_name, custom, work_item):
+    file_name, idx, data, after_directive = work_item
+
     if data.startswith("@"):
-        return ""  # Directive; ignore.
+        return "", None, None  # Directive; ignore.
 
     fontfile, options, unicodes, glyphs_expected = data.split(";")
 
@@ -120,177 +380,277 @@ def convert_test_file(
 
     # Some fonts contain escaped spaces, remove them.
     fontfile = fontfile.replace("\\ ", " ")
-    fontfile_rs = fontfile if custom else update_font_path(tests_name, fontfile)
 
-    unicodes_rs = convert_unicodes(unicodes)
+    # Only a few distinct fonts and options are shared by all test cases, and
+    # they are used as keys for the memoized helpers below.
+    fontfile = sys.intern(fontfile)
+    options = sys.intern(options)
 
-    test_name = file_name.replace(".tests", "").replace("-", "_") + f"_{idx:03d}"
-    test_name = test_name.lower()
+    test_name = f"{test_name_prefix(file_name)}_{idx:03d}"
 
     if test_name in IGNORE_TEST_CASES:
-        return ""
+        return "", None, None
+
+    fontfile_rs, font = resolve_font_path_rs(tests_name, fontfile, custom)
+
+    unicodes_rs = convert_unicodes(unicodes)
+
+    # Unless a test case selects the FreeType font functions, harfbuzz checks its
+    # stored result with its OpenType ones as well, so the result is valid for
+    # the embedded OpenType engine, which we are using. For the other cases we
+    # have to actually run hb-shape instead of using predefined results, because
+    # hb sometimes stores results for freetype and not for embedded OpenType
+    # engine, or because we change options that affect the output. MacOS results
+    # are known to be outdated and always re-run as well. `@` directives change
+    # the options of the cases that follow them, which we ignore, so stored
+    # results after a directive weren't necessarily produced with our options.
+    use_stored_result = (
+        not custom
+        and tests_name != "macos"
+        and not after_directive
+        and glyphs_expected.startswith("[")
+        and not STORED_RESULT_OPTIONS_RE.search(options)
+    )
 
     options = prune_test_options(options)
 
-    # We have to actually run hb-shape instead of using predefined results,
-    # because hb sometimes stores results for freetype and not for embedded OpenType
-    # engine, which we are using.
     if len(options) != 0:
         options_list = options.split(" ")
     else:
         options_list = []
 
-    options_list.insert(0, str(hb_shape_exe))
+    abs_font_path = resolve_abs_font_path(root_dir, tests_name, fontfile, custom)
 
-    abs_font_path = (
-        root_dir.joinpath(fontfile_rs)
-        if custom
-        else (
-            root_dir.joinpath("test/shape/data")
-            .joinpath(tests_name)
-            .joinpath("tests")
-            .joinpath(fontfile)
-        )
-    )
-
-    options_list.append(str(abs_font_path))
+    options_list.append(abs_font_path)
     options_list.append(f"--unicodes={unicodes}")  # no need to escape it
 
-    if glyphs_expected != "*":
+    cache_entry = None
+    if use_stored_result:
+        glyphs_expected = glyphs_expected.strip()[1:-1]
+    elif glyphs_expected != "*":
+        memo_key = (abs_font_path, options, unicodes)
+        glyphs_expected = _shape_memo.get(memo_key)
 
-        glyphs_expected = subprocess.run(
-            options_list, check=True, stdout=subprocess.PIPE
-        ).stdout.decode()
+        if glyphs_expected is None:
+            cache_key = shape_cache_key(abs_font_path, options, unicodes)
+            glyphs_expected = lookup_shape_cache(cache_key)
+
+            if glyphs_expected is None:
+                glyphs_expected = run_hb_shape(hb_shape_exe, options_list)
+
+                glyphs_expected = glyphs_expected.strip()[
+                    1:-1
+                ]  # remove leading and trailing whitespaces and `[..]`
 
-        glyphs_expected = glyphs_expected.strip()[
-            1:-1
-        ]  # remove leading and trailing whitespaces and `[..]`
+                cache_entry = (cache_key, glyphs_expected)
+
+            _shape_memo[memo_key] = glyphs_expected
 
     options_rs = options
     options_rs = options_rs.replace('"', '\\"')
     options_rs = options_rs.replace(" --single-par", "")
 
-    if not fontfile.startswith("/"):
-        fonts.add(os.path.split(fontfile_rs)[1])
-
     if glyphs_expected == "*":
-        final_string = (
-            f"#[test]\n"
-            f"fn {test_name}() {{\n"
-            f"    shape(\n"
-            f'        "{fontfile_rs}",\n'
-            f'        "{unicodes_rs}",\n'
-            f'        "{options_rs}",\n'
-            f"    );\n"
-            f"}}\n"
-            "\n"
+        final_string = SHAPE_TEST_TEMPLATE.substitute(
+            name=test_name, font=fontfile_rs, unicodes=unicodes_rs, options=options_rs
         )
     else:
-        final_string = (
-            f"#[test]\n"
-            f"fn {test_name}() {{\n"
-            f"    assert_eq!(\n"
-            f"        shape(\n"
-            f'            "{fontfile_rs}",\n'
-            f'            "{unicodes_rs}",\n'
-            f'            "{options_rs}",\n'
-            f"        ),\n"
-            f'        "{glyphs_expected}"\n'
-            f"    );\n"
-            f"}}\n"
-            "\n"
+        final_string = ASSERT_SHAPE_TEST_TEMPLATE.substitute(
+            name=test_name,
+            font=fontfile_rs,
+            unicodes=unicodes_rs,
+            options=options_rs,
+            glyphs=glyphs_expected,
         )
 
     if file_name == "macos.tests":
         final_string = '#[cfg(target_os = "macos")]\n' + final_string
 
-    return final_string
+    return final_string, font, cache_entry
+
 
+# Number of consecutive test cases that are grouped by `shape_sort_key`.
+SHAPE_ORDER_WINDOW = 1024
 
-# Returns an iterator over single test cases in a test file
+
+# Groups `(file_name, idx, data, after_directive)` test cases by font, options and unicodes.
+def shape_sort_key(work_item):
+    return work_item[2].split(";", 3)[:3]
+
+
+# Returns an iterator over single test cases in a test file, together with
+# whether an `@` directive came before them.
 def read_test_cases(path):
-    with open(path, "r") as f:
+    with open(path, "rb") as f:
         idx = 0
-        for test in f.read().splitlines():
-            # skip comments and empty lines
-            if test.startswith("#") or len(test) == 0:
+        after_directive = False
+        for line in f:
+            # skip comments and empty lines without decoding them
+            if line[:1] in (b"#", b"\n", b"\r"):
                 continue
 
-            yield idx, test
+            yield idx, line.rstrip(b"\r\n").decode("utf-8"), after_directive
             idx += 1
 
+            if line[:1] == b"@":
+                after_directive = True
+
+
+# Copies the font `src` to `dst`, hardlinking it when possible.
+#
+# Does nothing when `dst` already has the same contents, so fonts that didn't
+# change between runs aren't touched.
+def link_or_copy(src, dst):
+    if os.path.exists(dst):
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+        if src_stat.st_size == dst_stat.st_size and (
+            src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+            or font_hash(src) == font_hash(dst)
+        ):
+            return
+
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different file systems or no hardlink support. `copy2` keeps the
+        # mtime, so the next run can skip this font without hashing it.
+        shutil.copy2(src, dst)
+
 
 # Convert all test files in a folder into Rust tests and write them into a file.
-def convert_test_folder(root_dir, hb_shape_exe, tests_dir, tests_name, custom):
-    files = sorted(os.listdir(tests_dir))
-    files = [f for f in files if f.endswith(".tests") and f not in IGNORE_TESTS]
+def convert_test_folder(
+    root_dir, hb_shape_exe, executor, tests_dir, tests_name, custom
+):
+    files = sorted(
+        entry.name
+        for entry in os.scandir(tests_dir)
+        if entry.name.endswith(".tests")
+        and entry.name not in IGNORE_TESTS
+        and entry.is_file()
+    )
 
     return convert_test_files(
-        root_dir, hb_shape_exe, tests_dir, tests_name, files, custom
+        root_dir, hb_shape_exe, executor, tests_dir, tests_name, files, custom
     )
 
 
-def convert_test_files(root_dir, hb_shape_exe, tests_dir, tests_name, files, custom):
+# Returns the names of the used fonts and the new `(key, glyphs)` entries for
+# the shape cache.
+def convert_test_files(
+    root_dir, hb_shape_exe, executor, tests_dir, tests_name, files, custom
+):
     fonts = set()
+    cache_entries = []
 
     macos_snippet = "#[cfg(target_os = \"macos\")]\n" if tests_name == "macos" else ""
     
-    rust_code = (
-        "// WARNING: this file was generated by ../scripts/gen-shaping-tests.py\n"
-        "\n" +
-        macos_snippet +
-        "use crate::shape;\n"
-        "\n"
+    tests_name_snake_case = tests_name.replace("-", "_")
+    out_path = f"../tests/shaping/{tests_name_snake_case}.rs"
+
+    # Every test case is an independent `hb-shape` invocation, so we can
+    # spread them over all cores.
+    work_items = [
+        (file, idx + 1, test, after_directive)
+        for file in files
+        for idx, test, after_directive in read_test_cases(tests_dir / file)
+    ]
+    # Like font paths and options, the folder name is a key for the memoized
+    # helpers, but it's the same for every test case in here.
+    worker = functools.partial(
+        convert_test_file,
+        root_dir,
+        str(hb_shape_exe),
+        sys.intern(tests_name),
+        custom,
     )
 
-    for file in files:
-        path = tests_dir / file
+    # Hand the test cases out grouped by font and options, so that every
+    # worker's `hb-shape` sees the same font consecutively and can keep reusing
+    # its face and shape plans. Only consecutive windows of test cases are
+    # sorted, so that restoring the file order never has to buffer more than
+    # one window of snippets.
+    order = []
+    for start in range(0, len(work_items), SHAPE_ORDER_WINDOW):
+        end = min(start + SHAPE_ORDER_WINDOW, len(work_items))
+        order += sorted(
+            range(start, end), key=lambda i: shape_sort_key(work_items[i])
+        )
 
-        for idx, test in read_test_cases(path):
-            rust_code += convert_test_file(
-                root_dir, hb_shape_exe, tests_name, file, idx + 1, test, fonts, custom
-            )
+    # Snippets are written out as soon as they are produced. The last one is
+    # held back, so that we can strip the extra trailing newline from it to
+    # avoid formatting churn.
+    with open(out_path, "w", buffering=1 << 20) as f:
+        pending = (
+            "// WARNING: this file was generated by ../scripts/gen-shaping-tests.py\n"
+            "\n" +
+            macos_snippet +
+            "use crate::shape;\n"
+            "\n"
+        )
 
-    # Strip the extra trailing newline to avoid formatting churn
-    rust_code = rust_code[:-1]
-    tests_name_snake_case = tests_name.replace("-", "_")
-    with open(f"../tests/shaping/{tests_name_snake_case}.rs", "w") as f:
-        f.write(rust_code)
+        results = executor.map(
+            worker, [work_items[i] for i in order], chunksize=32
+        )
 
-    return fonts
+        # Snippets arrive sorted within their window, so buffer them until all
+        # of the preceding ones have been written.
+        snippets = {}
+        next_pos = 0
+        for pos, (snippet, font, cache_entry) in zip(order, results):
+            if font is not None:
+                fonts.add(font)
+            if cache_entry is not None:
+                cache_entries.append(cache_entry)
 
+            snippets[pos] = snippet
+            while next_pos in snippets:
+                snippet = snippets.pop(next_pos)
+                next_pos += 1
+                if snippet:
+                    f.write(pending)
+                    pending = snippet
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: gen-shaping-tests.py /path/to/harfbuzz-src")
-        exit(1)
+        f.write(pending[:-1])
 
-    hb_dir = Path(sys.argv[1])
-    assert hb_dir.exists()
+    return fonts, cache_entries
 
-    rb_root = pathlib.Path(__file__).parent.parent
 
-    # Check that harfbuzz was built.
-    hb_shape_exe = hb_dir.joinpath("builddir/util/hb-shape")
-    check_hb_build(hb_shape_exe)
+def store_shape_cache_entries(shape_cache, cache_entries):
+    shape_cache.executemany("INSERT OR REPLACE INTO c VALUES (?, ?)", cache_entries)
 
+
+def convert_all(hb_dir, rb_root, hb_shape_exe, executor, shape_cache):
     def to_hb_absolute(name):
         return hb_dir / f"test/shape/data/{name}/tests"
 
-    # First we convert all harfbuzz tests that are not disabled
-    test_dir_names = ["aots", "in-house", "text-rendering-tests"]
-    for test_dir_name in test_dir_names:
+    def convert_hb_folder(test_dir_name):
         tests_dir = to_hb_absolute(test_dir_name)
 
-        dir_used_fonts = convert_test_folder(
-            hb_dir, hb_shape_exe, tests_dir, test_dir_name, False
+        dir_used_fonts, cache_entries = convert_test_folder(
+            hb_dir, hb_shape_exe, executor, tests_dir, test_dir_name, False
         )
         for filename in dir_used_fonts:
-            shutil.copy(
+            link_or_copy(
                 hb_dir / f"test/shape/data/{test_dir_name}/fonts/{filename}",
-                f"../tests/fonts/{test_dir_name}",
+                f"../tests/fonts/{test_dir_name}/{filename}",
             )
 
+        return cache_entries
+
+    # First we convert all harfbuzz tests that are not disabled. Every folder
+    # has its own output file and fonts directory, so they can be converted
+    # concurrently.
+    test_dir_names = ["aots", "in-house", "text-rendering-tests"]
+    with ThreadPoolExecutor(max_workers=len(test_dir_names)) as folder_executor:
+        futures = [
+            folder_executor.submit(convert_hb_folder, test_dir_name)
+            for test_dir_name in test_dir_names
+        ]
+        for future in futures:
+            store_shape_cache_entries(shape_cache, future.result())
+
     # Next we convert harfbuzz MacOS tests as well as custom MacOS tests, but only if the person running this
     # script is also running MacOS, otherwise they won't have the system fonts and
     # thus can't run the tests.
@@ -298,17 +658,58 @@ def main():
         # macos.tests are not directly copied from harfbuzz, but instead from
         # `macos.tests` in this folder. See the README for more information.
         tests_dir = rb_root / "tests" / "custom"
-        convert_test_files(
-            rb_root, hb_shape_exe, tests_dir, "macos", ["macos.tests"], False
+        _, cache_entries = convert_test_files(
+            rb_root,
+            hb_shape_exe,
+            executor,
+            tests_dir,
+            "macos",
+            ["macos.tests"],
+            False,
         )
+        store_shape_cache_entries(shape_cache, cache_entries)
 
     # Next we convert all of the custom tests (except MacOS tests). The test files themselves
     # are in the same format as the harfbuzz ones (i.e. they contain the arguments in the same form as
     # harfbuzz tests, but are instead stored in the rustybuzz folder. In addition to that, font paths
     # are relative to fonts stored inside of rustybuzz and not harfbuzz)
-    convert_test_folder(
-        rb_root, hb_shape_exe, rb_root / "tests" / "custom", "custom", True
+    _, cache_entries = convert_test_folder(
+        rb_root,
+        hb_shape_exe,
+        executor,
+        rb_root / "tests" / "custom",
+        "custom",
+        True,
+    )
+    store_shape_cache_entries(shape_cache, cache_entries)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: gen-shaping-tests.py /path/to/harfbuzz-src")
+        exit(1)
+
+    hb_dir = Path(sys.argv[1])
+    assert hb_dir.exists()
+
+    rb_root = pathlib.Path(__file__).parent.parent
+
+    # Check that harfbuzz was built.
+    hb_shape_exe = hb_dir.joinpath("builddir/util/hb-shape")
+    check_hb_build(hb_shape_exe)
+
+    shape_cache = open_shape_cache(hb_dir, hb_shape_exe)
+    # The workers are shared by test folders that are converted from multiple
+    # threads, so spawn them instead of forking a multi-threaded process.
+    executor = ProcessPoolExecutor(
+        max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
     )
+    try:
+        with executor:
+            convert_all(hb_dir, rb_root, hb_shape_exe, executor, shape_cache)
+    finally:
+        shape_cache.commit()
+        shape_cache.close()
 
 
 if __name__ == "__main__":